@@ -0,0 +1,145 @@
+"""
+Download helpers shared by the dataset phases.
+
+Kept free of heavy imports (pandas, objaverse, pyarrow, aiohttp) so that
+importing it, including in worker processes, stays cheap.
+"""
+import os
+import asyncio
+import itertools
+from manifest import ObjectRecord
+
+SUPPORTED_EXTS = ['.glb', '.gltf', '.obj', '.fbx', '.ply']
+DOWNLOAD_CHUNK_SIZE = 65536
+# Top-level folder under the download dir -> manifest source
+SOURCE_MAP = {
+    'smithsonian': 'smithsonian',
+    'objaverse_legacy': 'objaverse-plusplus',
+    'github': 'github',
+}
+
+def dummy_callback(*args, **kwargs):
+    """Dummy callback for multiprocessing."""
+    pass
+
+async def download_one(session, sem, url, target_path):
+    """Download a single file from a URL. Returns (ok, url, target_path).
+    
+    Data is streamed into target_path + ".part" and renamed on success, so
+    an interrupted download resumes with a Range request on the next run.
+    The target directory must already exist.
+    """
+    part_path = target_path + ".part"
+    async with sem:
+        try:
+            try:
+                offset = os.path.getsize(part_path)
+            except OSError:
+                offset = 0
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+            
+            async with session.get(url, headers=headers) as response:
+                if offset and response.status == 416:
+                    # Nothing left past the offset: the part file is complete
+                    os.replace(part_path, target_path)
+                    return True, url, target_path
+                response.raise_for_status()
+                
+                # Append only if the server honoured the range request
+                mode = 'ab' if response.status == 206 else 'wb'
+                with open(part_path, mode) as f:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+            os.replace(part_path, target_path)
+            return True, url, target_path
+        except Exception:
+            # print(f"Error downloading {url}: {e}")
+            return False, url, target_path
+
+async def download_all(tasks, concurrency, on_success=None):
+    """Download (url, path) tasks over a single pooled HTTP session.
+    
+    on_success(url, path) is called in the event loop as each download
+    finishes, so callers can record results without rescanning the disk.
+    """
+    import aiohttp
+    from tqdm.asyncio import tqdm as atqdm
+    
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=64, ttl_dns_cache=600)
+    timeout = aiohttp.ClientTimeout(total=120)
+    sem = asyncio.Semaphore(concurrency)
+    
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        coros = [download_one(session, sem, url, path) for url, path in tasks]
+        results = []
+        for f in atqdm.as_completed(coros, total=len(coros)):
+            ok, url, path = await f
+            if ok and on_success is not None:
+                on_success(url, path)
+            results.append(ok)
+        return results
+
+def iter_files(root):
+    """Yield os.DirEntry objects for every file under root."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+def scan_downloaded_objects(download_dir, known_ids=frozenset(), sources=None):
+    """Scan download directory and create manifest records.
+    
+    Files whose ID is in known_ids are skipped without building a record.
+    If sources is given, only the top-level folders for those sources are
+    scanned.
+    """
+    print("Scanning downloaded objects...")
+    objects = []
+    supported_exts = frozenset(SUPPORTED_EXTS)
+    prefix_len = len(os.path.join(download_dir, ""))
+    
+    if sources is None:
+        roots = [download_dir]
+    else:
+        roots = [
+            os.path.join(download_dir, folder)
+            for folder, source in SOURCE_MAP.items()
+            if source in sources and os.path.isdir(os.path.join(download_dir, folder))
+        ]
+    
+    for entry in itertools.chain.from_iterable(map(iter_files, roots)):
+        name = entry.name
+        dot = name.rfind('.')
+        if dot < 0:
+            continue
+        ext = name[dot:].lower()
+        if ext in supported_exts:
+            # Generate simple ID from filename
+            obj_id = name[:dot]
+            # Some IDs might be long, but we need the full UID for Objaverse++
+            if obj_id in known_ids:
+                continue
+            
+            rel_path = entry.path[prefix_len:]
+            
+            # Determine source from the top-level folder
+            first = rel_path.split(os.sep, 1)[0].lower()
+            source = SOURCE_MAP.get(first, "unknown")
+            
+            obj = ObjectRecord(
+                id=obj_id,
+                source_url=f"file://{rel_path}",
+                local_path=rel_path,
+                file_type=ext[1:],
+                source=source,
+                license=None,
+                sha256=obj_id,
+                download_status="success"
+            )
+            objects.append(obj)
+    
+    return objects
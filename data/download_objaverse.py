@@ -1,83 +1,26 @@
-import objaverse.xl as oxl
-import pandas as pd
 import os
 import multiprocessing
 import argparse
-from pathlib import Path
+import asyncio
 from manifest import Manifest, ObjectRecord
+from download_common import dummy_callback, download_all, scan_downloaded_objects
 import gc
-import requests
-from tqdm import tqdm
 
-SUPPORTED_EXTS = ['.glb', '.gltf', '.obj', '.fbx', '.ply']
-
-def dummy_callback(*args, **kwargs):
-    """Dummy callback for multiprocessing."""
-    pass
-
-def download_file(args):
-    """Download a single file from a URL."""
-    url, target_path = args
-    try:
-        if os.path.exists(target_path):
-            return True # Skip if exists
-            
-        os.makedirs(os.path.dirname(target_path), exist_ok=True)
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        with open(target_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        return True
-    except Exception:
-        # print(f"Error downloading {url}: {e}")
-        return False
-
-def scan_downloaded_objects(download_dir):
-    """Scan download directory and create manifest records."""
-    print("Scanning downloaded objects...")
-    objects = []
-    # supported_exts = {'.glb', '.gltf', '.obj', '.fbx', '.blend', '.stl'} 
-    # Use global constant
-    supported_exts = set(SUPPORTED_EXTS)
-    
-    for root, dirs, files in os.walk(download_dir):
-        for file in files:
-            ext = Path(file).suffix.lower()
-            if ext in supported_exts:
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, download_dir)
-                
-                # Generate simple ID from filename
-                obj_id = Path(file).stem
-                # Some IDs might be long, but we need the full UID for Objaverse++
-                
-                # Determine source based on path
-                source = "unknown"
-                if "smithsonian" in rel_path.lower():
-                    source = "smithsonian"
-                elif "objaverse_legacy" in rel_path.lower():
-                    source = "objaverse-plusplus"
-                elif "github" in rel_path.lower():
-                    source = "github"
-                
-                obj = ObjectRecord(
-                    id=obj_id,
-                    source_url=f"file://{rel_path}",
-                    local_path=rel_path,
-                    file_type=ext[1:],
-                    source=source,
-                    license=None,
-                    sha256=obj_id,
-                    download_status="success"
-                )
-                objects.append(obj)
-    
-    return objects
+# Downloads are network-bound; more processes than this just add
+# connection churn and fork overhead.
+MAX_NET_PROCESSES = 16
+PLUSPLUS_REPO = "cindyxl/ObjaversePlusPlus"
+# --dataset choice -> manifest source
+DATASET_SOURCES = {
+    'smithsonian': 'smithsonian',
+    'objaverse_plusplus': 'objaverse-plusplus',
+}
 
 def download_smithsonian(args, manifest):
     """Download Smithsonian objects."""
+    import objaverse.xl as oxl
+    import pandas as pd
+    
     print("\n=== Phase 1: Smithsonian Objects ===")
     
     # Load Objaverse-XL annotations
@@ -118,12 +61,25 @@ def download_smithsonian(args, manifest):
     oxl.download_objects(
         objects=to_download,
         download_dir=args.download_dir,
-        processes=args.processes,
+        processes=args.net_processes,
         handle_found_object=dummy_callback,
         handle_missing_object=dummy_callback
     )
     print("Smithsonian download complete.")
 
+def iter_plusplus_batches(batch_size=65536):
+    """Yield Arrow record batches of (UID, score) from the Objaverse++ Parquet shards."""
+    from huggingface_hub import HfApi, hf_hub_download
+    import pyarrow.parquet as pq
+    
+    shards = sorted(
+        f for f in HfApi().list_repo_files(PLUSPLUS_REPO, repo_type="dataset")
+        if f.endswith(".parquet")
+    )
+    for shard in shards:
+        pf = pq.ParquetFile(hf_hub_download(PLUSPLUS_REPO, shard, repo_type="dataset"))
+        yield from pf.iter_batches(columns=['UID', 'score'], batch_size=batch_size)
+
 def download_objaverse_plusplus(args, manifest):
     """Download Objaverse++ High Quality objects."""
     print("\n=== Phase 2: Objaverse++ High Quality Objects ===")
@@ -132,34 +88,32 @@ def download_objaverse_plusplus(args, manifest):
     print("Loading Objaverse++ metadata...")
     high_quality_uids = []
     try:
-        from datasets import load_dataset
-        dataset = load_dataset("cindyxl/ObjaversePlusPlus", split="train", streaming=True)
+        import pyarrow.compute as pc
         
         needed = args.target_count
         print(f"Targeting {needed} objects.")
         
-        # Score 3
-        print("Collecting Score 3 (Superior) objects...")
-        for item in dataset:
-            if item.get('score', 0) >= 3:
-                high_quality_uids.append(item['UID'])
-                if len(high_quality_uids) >= needed:
-                    break
+        # Single pass: Score 3 (Superior) first, Score 2 (High) as reserve.
+        # Stop once Score 3 alone covers the target, or at 3x the target
+        # overall as a safety cap.
+        print("Collecting Score 3 (Superior) and Score 2 (High) objects...")
+        primary, reserve = [], []
+        for batch in iter_plusplus_batches():
+            uids = batch.column('UID')
+            scores = batch.column('score')
+            primary.extend(uids.filter(pc.greater_equal(scores, 3)).to_pylist())
+            reserve.extend(uids.filter(pc.equal(scores, 2)).to_pylist())
+            if len(primary) >= needed:
+                break
+            if len(primary) + len(reserve) >= needed * 3:
+                break
         
-        # Score 2
-        if len(high_quality_uids) < needed:
-            print(f"Collecting Score 2 (High) objects (have {len(high_quality_uids)}, need {needed})...")
-            dataset_2 = load_dataset("cindyxl/ObjaversePlusPlus", split="train", streaming=True)
-            for item in dataset_2:
-                if item.get('score', 0) == 2:
-                    high_quality_uids.append(item['UID'])
-                    if len(high_quality_uids) >= needed:
-                        break
-                        
+        high_quality_uids = (primary + reserve)[:needed]
+        print(f"Score 3: {len(primary)}, Score 2: {len(reserve)}")
         print(f"Collected {len(high_quality_uids)} high quality UIDs.")
         
     except ImportError:
-        print("Error: 'datasets' library not found. Install with: pip install datasets")
+        print("Error: 'pyarrow' or 'huggingface_hub' not found. Install with: pip install pyarrow huggingface_hub")
         return
     except Exception as e:
         print(f"Error loading Objaverse++ metadata: {e}")
@@ -175,32 +129,56 @@ def download_objaverse_plusplus(args, manifest):
     object_paths = objaverse._load_object_paths()
     
     # 3. Prepare download tasks
-    tasks = []
     base_url = "https://huggingface.co/datasets/allenai/objaverse/resolve/main/"
     target_dir = os.path.join(args.download_dir, "objaverse_legacy")
+    os.makedirs(target_dir, exist_ok=True)
     
     print("Preparing download tasks...")
-    for uid in high_quality_uids:
-        if uid in object_paths:
-            rel_path = object_paths[uid]
-            url = base_url + rel_path
-            # Save as uid.glb in objaverse_legacy folder
-            # We flatten the structure to avoid deep nesting if desired, or keep it?
-            # User said "save ... to the home objaverse folder".
-            # Let's keep it simple: objaverse_legacy/{uid}.glb
-            local_path = os.path.join(target_dir, f"{uid}.glb")
-            tasks.append((url, local_path))
-            
+    # Flattened layout: objaverse_legacy/{uid}.glb
+    target_prefix = os.path.join(target_dir, "")
+    get_path = object_paths.get
+    tasks = [
+        (f"{base_url}{rel_path}", f"{target_prefix}{uid}.glb")
+        for uid in high_quality_uids
+        if (rel_path := get_path(uid)) is not None
+    ]
+    
     print(f"Prepared {len(tasks)} downloads.")
     
     if args.limit and len(tasks) > args.limit:
         tasks = tasks[:args.limit]
         print(f"Limiting to {len(tasks)} downloads.")
     
-    # 4. Download with progress bar
-    print(f"Downloading with {args.processes} processes...")
-    with multiprocessing.Pool(processes=args.processes) as pool:
-        results = list(tqdm(pool.imap_unordered(download_file, tasks), total=len(tasks)))
+    # Skip work that is already done: one directory listing and in-memory
+    # manifest lookups instead of a stat() per task
+    with os.scandir(target_dir) as it:
+        done = {entry.name for entry in it}
+    known_ids = manifest.object_ids("objaverse-plusplus")
+    pending = []
+    for url, path in tasks:
+        name = os.path.basename(path)
+        if name not in done and os.path.splitext(name)[0] not in known_ids:
+            pending.append((url, path))
+    if len(pending) < len(tasks):
+        print(f"Skipping {len(tasks) - len(pending)} already downloaded objects.")
+    tasks = pending
+    
+    # 4. Download with progress bar, adding each object to the manifest as it lands
+    def record_download(url, path):
+        uid = os.path.splitext(os.path.basename(path))[0]
+        manifest.add_object(ObjectRecord(
+            id=uid,
+            source_url=url,
+            local_path=os.path.relpath(path, args.download_dir),
+            file_type="glb",
+            source="objaverse-plusplus",
+            license=None,
+            sha256=uid,
+            download_status="success"
+        ))
+    
+    print(f"Downloading with {args.concurrency} concurrent connections...")
+    results = asyncio.run(download_all(tasks, args.concurrency, on_success=record_download))
     
     success = sum(results)
     print(f"Objaverse++ download complete. Success: {success}/{len(tasks)}")
@@ -212,11 +190,22 @@ def main():
     parser.add_argument("--target-count", type=int, default=30000, help="Number of objects to download per dataset.")
     parser.add_argument("--download-dir", type=str, default="./data/objaverse", help="Directory to save objects.")
     parser.add_argument("--limit", type=int, default=None, help="Limit number of downloads (for testing).")
-    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="Number of processes to use.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help=f"Number of processes to use (default: CPU count; network downloads are capped at {MAX_NET_PROCESSES}).")
+    parser.add_argument("--concurrency", type=int, default=256, help="Max concurrent HTTP downloads for Objaverse++.")
     parser.add_argument("--resume", action="store_true", help="Resume from existing manifest.")
     
     args = parser.parse_args()
     
+    # Workers forked from a small server process don't inherit whatever
+    # heavy modules the parent has imported by the time a pool starts
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method("forkserver")
+    
+    if args.processes is None:
+        args.processes = multiprocessing.cpu_count()
+    args.net_processes = min(args.processes, MAX_NET_PROCESSES)
+    
     # Expand user path
     args.download_dir = os.path.expanduser(args.download_dir)
     os.makedirs(args.download_dir, exist_ok=True)
@@ -238,26 +227,25 @@ def main():
         
     # Update Manifest
     print("\nUpdating manifest...")
-    objects = scan_downloaded_objects(args.download_dir)
+    # Existing records are skipped to preserve their render status. Only the
+    # manifest shards for the requested datasets are loaded.
+    sources = None if args.dataset == 'all' else [DATASET_SOURCES[args.dataset]]
+    known_ids = manifest.object_ids(*(sources or []))
+    objects = scan_downloaded_objects(args.download_dir, known_ids=known_ids, sources=sources)
     for obj in objects:
-        # Only add if not exists or update?
-        # scan_downloaded_objects creates new records.
-        # We should check if it exists to preserve render status if any.
-        existing = manifest.get_object(obj.id)
-        if existing:
-            # Update fields but keep status if already success
-            # Actually, just keep existing unless we want to force update
-            pass
-        else:
+        # First file wins if the same ID shows up in several places
+        if obj.id not in known_ids:
+            known_ids.add(obj.id)
             manifest.add_object(obj)
             
-    manifest.save()
+    manifest.compact()
     
     stats = manifest.get_stats()
+    by_source = manifest.stats_by_source()
     print(f"\nFinal Statistics:")
     print(f"Total objects: {stats['total']}")
-    print(f"Smithsonian: {len([o for o in manifest.get_all_objects() if o.source == 'smithsonian'])}")
-    print(f"Objaverse++: {len([o for o in manifest.get_all_objects() if o.source == 'objaverse-plusplus'])}")
+    print(f"Smithsonian: {by_source.get('smithsonian', 0)}")
+    print(f"Objaverse++: {by_source.get('objaverse-plusplus', 0)}")
 
 if __name__ == "__main__":
     main()
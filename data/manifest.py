@@ -2,21 +2,105 @@
 Manifest management utilities for tracking download and render progress.
 """
 import json
+import mmap
+import os
+import sys
+from collections import Counter, defaultdict
 from datetime import datetime
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass, asdict
+from typing import Dict, Iterator, List, Optional, Set, Any
+from dataclasses import dataclass, fields
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
+
+def _dumps(data: Any, indent: bool = False) -> bytes:
+    """Serialize to JSON bytes, using orjson when available."""
+    if orjson is not None:
+        # orjson encodes dataclasses natively
+        return orjson.dumps(data, default=_json_default,
+                            option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(data, default=_json_default, indent=2).encode()
+    return json.dumps(data, default=_json_default, separators=(",", ":")).encode()
+
+
+def _loads(raw: bytes) -> Any:
+    """Parse JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _load_file(path: Path) -> Any:
+    """Parse a JSON file.
+    
+    With orjson the file is memory-mapped and parsed in place instead of
+    being read into an intermediate bytes object first.
+    """
+    with open(path, 'rb') as f:
+        if orjson is None or os.fstat(f.fileno()).st_size == 0:
+            return _loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                return orjson.loads(view)
+            finally:
+                view.release()
+
+
+def _write_file(path: Path, data: Any):
+    """Write a JSON file atomically (tmp + rename)."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(_dumps(data, indent=True))
+    os.replace(tmp_path, path)
+
+
+def _read_journal(path: Path) -> Iterator[Dict[str, Any]]:
+    """Yield the records appended to a JSONL journal."""
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield _loads(line)
+            except ValueError:
+                # Torn line from an interrupted run; later lines are intact
+                continue
+
+
+def _open_journal(path: Path, buffering: int = 0):
+    """Open a JSONL journal for appending, starting on a fresh line."""
+    journal = open(path, 'ab', buffering=buffering)
+    if journal.tell():
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # Don't glue the next record onto a torn last line
+                journal.write(b"\n")
+    return journal
+
+
+# Slotted records are smaller and faster to access (Python 3.10+)
+_dataclass = dataclass(slots=True) if sys.version_info >= (3, 10) else dataclass
+
+
+@_dataclass
 class ViewInfo:
     """Information about a rendered view."""
     view_id: int
     image_path: str
     mask_path: str
+    # Pixel encoding of image_path: "srgb" (view-transformed, straight alpha;
+    # PNG) or "linear_premultiplied" (scene-linear, premultiplied; EXR)
+    colorspace: str = "srgb"
 
 
-@dataclass
+@_dataclass
 class ObjectRecord:
     """Record for a single 3D object in the dataset."""
     id: str
@@ -38,61 +122,293 @@ class ObjectRecord:
             self.views = []
 
 
+_OBJ_FIELDS = tuple(f.name for f in fields(ObjectRecord))
+_VIEW_FIELDS = tuple(f.name for f in fields(ViewInfo))
+
+
+def _record_to_dict(obj: ObjectRecord) -> Dict[str, Any]:
+    """Shallow equivalent of asdict(obj) without the recursive deepcopy."""
+    d = {n: getattr(obj, n) for n in _OBJ_FIELDS}
+    d["views"] = [{n: getattr(v, n) for n in _VIEW_FIELDS} for v in (obj.views or [])]
+    return d
+
+
+def _record_from_dict(obj_dict: Dict[str, Any]) -> ObjectRecord:
+    """Build an ObjectRecord (and its ViewInfos) from its JSON form."""
+    views = [ViewInfo(**v) for v in obj_dict.get("views") or []]
+    return ObjectRecord(**{**obj_dict, "views": views})
+
+
+def _json_default(o: Any) -> Any:
+    """Encode records for the stdlib json fallback."""
+    if isinstance(o, ObjectRecord):
+        return _record_to_dict(o)
+    if isinstance(o, ViewInfo):
+        return {n: getattr(o, n) for n in _VIEW_FIELDS}
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
 class Manifest:
-    """Manages the dataset manifest file."""
+    """Manages the dataset manifest.
+    
+    The manifest is stored as one shard per source in a directory next to
+    manifest_path (manifest.json -> manifest/<source>.json), plus a small
+    manifest/index.json with per-source counts. Shards are loaded lazily on
+    first access, so get_stats() and single-source runs never read the other
+    sources' records.
+    
+    Records are held in memory as ObjectRecord instances and only converted
+    to JSON at the load/save boundaries. Updates are appended to a per-shard
+    JSONL journal (manifest/<source>.jsonl) and only folded into the shard
+    files by compact().
     
-    def __init__(self, manifest_path: str):
+    By default every journal write goes straight to the OS. Pass a
+    journal_buffering size in bytes to batch writes instead; they then
+    reach disk on flush() or compact().
+    """
+    
+    def __init__(self, manifest_path: str, journal_buffering: int = 0):
         self.manifest_path = Path(manifest_path)
-        self.data = self._load()
+        self.journal_buffering = journal_buffering
+        # manifest.json -> manifest/; a suffix-less path gets a distinct name
+        if self.manifest_path.suffix:
+            self.shard_dir = self.manifest_path.with_suffix("")
+        else:
+            self.shard_dir = self.manifest_path.with_name(self.manifest_path.name + "_shards")
+        self.index_path = self.shard_dir / "index.json"
+        self.version = "2.0"
+        self.created = datetime.now().isoformat()
+        
+        # source -> {id: ObjectRecord}, for loaded shards only
+        self._shards: Dict[str, Dict[str, ObjectRecord]] = {}
+        self._sources: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self._journals = {}
+        self._legacy_paths: List[Path] = []
+        
+        # Running per-source counters so get_stats() never rescans every
+        # record. Unloaded shards contribute the counts stored in the index.
+        # The buckets each record was counted under are remembered separately
+        # because callers may mutate a stored record before re-adding it.
+        self._status_counts: Dict[str, Counter] = defaultdict(Counter)
+        self._render_counts: Dict[str, Counter] = defaultdict(Counter)
+        self._counted: Dict[str, tuple] = {}
+        
+        self._load()
+    
+    def _shard_path(self, source: str) -> Path:
+        return self.shard_dir / f"{source}.json"
+    
+    def _journal_path(self, source: str) -> Path:
+        return self.shard_dir / f"{source}.jsonl"
     
-    def _load(self) -> Dict[str, Any]:
-        """Load manifest from disk or create new."""
-        if self.manifest_path.exists():
-            with open(self.manifest_path, 'r') as f:
-                return json.load(f)
+    def _count(self, obj: ObjectRecord, delta: int):
+        """Move a record into (delta=1) or out of (delta=-1) its buckets."""
+        if delta > 0:
+            key = (obj.download_status, obj.render_status, obj.source)
+            self._counted[obj.id] = key
         else:
-            return {
-                "version": "1.0",
-                "created": datetime.now().isoformat(),
-                "total_objects": 0,
-                "objects": {}
+            key = self._counted.pop(obj.id)
+        download_status, render_status, source = key
+        self._status_counts[source][download_status] += delta
+        self._render_counts[source][render_status] += delta
+    
+    def _load(self):
+        """Read the index, or migrate a single-file manifest.json."""
+        if self.index_path.exists():
+            index = _load_file(self.index_path)
+            self.version = index["version"]
+            self.created = index["created"]
+            for source, shard in index["shards"].items():
+                self._sources.add(source)
+                self._status_counts[source] = Counter(shard["download_status"])
+                self._render_counts[source] = Counter(shard["render_status"])
+        elif self.manifest_path.is_file() or self.manifest_path.with_suffix(".jsonl").is_file():
+            self._load_legacy()
+        
+        # Shards with un-compacted updates are loaded now so counts are exact
+        if self.shard_dir.is_dir():
+            with os.scandir(self.shard_dir) as it:
+                journaled = [e.name[:-len(".jsonl")] for e in it if e.name.endswith(".jsonl")]
+            for source in journaled:
+                if source in self._shards:
+                    # Migrated from a legacy manifest; the shard's journal
+                    # holds updates made since and still has to be replayed
+                    for obj_dict in _read_journal(self._journal_path(source)):
+                        self._store(_record_from_dict(obj_dict))
+                else:
+                    self._ensure_loaded(source)
+    
+    def _load_legacy(self):
+        """Load a single-file manifest.json (and its journal) into shards.
+        
+        The shards are written and the old files removed on compact().
+        """
+        objects = {}
+        if self.manifest_path.is_file():
+            legacy = _load_file(self.manifest_path)
+            self.created = legacy.get("created", self.created)
+            objects = legacy["objects"]
+            self._legacy_paths.append(self.manifest_path)
+        legacy_journal = self.manifest_path.with_suffix(".jsonl")
+        if legacy_journal.exists():
+            for obj_dict in _read_journal(legacy_journal):
+                objects[obj_dict["id"]] = obj_dict
+            self._legacy_paths.append(legacy_journal)
+        
+        for obj_dict in objects.values():
+            obj = _record_from_dict(obj_dict)
+            self._shards.setdefault(obj.source, {})[obj.id] = obj
+            self._count(obj, 1)
+        self._sources.update(self._shards)
+        self._dirty.update(self._shards)
+    
+    def _ensure_loaded(self, source: str) -> Dict[str, ObjectRecord]:
+        """Load a source's shard and replay its journal on first access."""
+        objects = self._shards.get(source)
+        if objects is not None:
+            return objects
+        
+        objects = {}
+        shard_path = self._shard_path(source)
+        if shard_path.exists():
+            objects = {
+                obj_id: _record_from_dict(obj_dict)
+                for obj_id, obj_dict in _load_file(shard_path)["objects"].items()
             }
+        journal_path = self._journal_path(source)
+        if journal_path.exists():
+            for obj_dict in _read_journal(journal_path):
+                objects[obj_dict["id"]] = _record_from_dict(obj_dict)
+            self._dirty.add(source)
+        
+        # Recount from the records; index counts only cover the last compaction
+        self._status_counts[source] = Counter()
+        self._render_counts[source] = Counter()
+        for obj in objects.values():
+            self._count(obj, 1)
+        
+        self._shards[source] = objects
+        self._sources.add(source)
+        return objects
     
-    def save(self):
-        """Save manifest to disk."""
-        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(self.manifest_path, 'w') as f:
-            json.dump(self.data, f, indent=2)
+    def _load_all(self):
+        for source in sorted(self._sources):
+            self._ensure_loaded(source)
+    
+    def save(self, force: bool = False):
+        """Write modified shards and the index to disk.
+        
+        Records are already persisted in the journals by add_object, so this
+        is a no-op unless force=True.
+        """
+        if not force:
+            return
+        
+        # Nothing is deleted until every shard and the index are on disk, so a
+        # crash midway leaves the journals (and any legacy files) to replay
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        written = sorted(self._dirty)
+        for source in written:
+            _write_file(self._shard_path(source), {"source": source, "objects": self._shards[source]})
+        
+        shards = {}
+        for source in sorted(self._sources):
+            status_counts = self._status_counts[source]
+            total = sum(status_counts.values())
+            if total:
+                shards[source] = {
+                    "total": total,
+                    "download_status": {k: n for k, n in status_counts.items() if n},
+                    "render_status": {k: n for k, n in self._render_counts[source].items() if n},
+                }
+        _write_file(self.index_path, {
+            "version": self.version,
+            "created": self.created,
+            "total_objects": sum(shard["total"] for shard in shards.values()),
+            "shards": shards,
+        })
+        
+        # Everything in the written shards' journals is now in the shards
+        for source in written:
+            journal = self._journals.pop(source, None)
+            if journal is not None:
+                journal.close()
+            journal_path = self._journal_path(source)
+            if journal_path.exists():
+                journal_path.unlink()
+        self._dirty.clear()
+        
+        # A migrated single-file manifest is fully superseded by the shards
+        for path in self._legacy_paths:
+            if path.exists():
+                path.unlink()
+        self._legacy_paths = []
+    
+    def flush(self):
+        """Push buffered journal writes to the OS."""
+        for journal in self._journals.values():
+            journal.flush()
+    
+    def compact(self):
+        """Fold the journals into the shard files and rewrite the index."""
+        self.save(force=True)
+    
+    def _store(self, obj: ObjectRecord):
+        """Put a record in its shard and update the counters."""
+        objects = self._ensure_loaded(obj.source)
+        previous = self._counted.get(obj.id)
+        if previous is not None:
+            self._count(obj, -1)
+            old_source = previous[2]
+            if old_source != obj.source:
+                del self._shards[old_source][obj.id]
+                self._dirty.add(old_source)
+        self._count(obj, 1)
+        objects[obj.id] = obj
+        self._dirty.add(obj.source)
     
     def add_object(self, obj: ObjectRecord):
         """Add or update an object record."""
-        # Convert dataclass to dict, handling nested ViewInfo objects
-        obj_dict = asdict(obj)
-        self.data["objects"][obj.id] = obj_dict
-        self.data["total_objects"] = len(self.data["objects"])
+        self._store(obj)
+        
+        journal = self._journals.get(obj.source)
+        if journal is None:
+            self.shard_dir.mkdir(parents=True, exist_ok=True)
+            journal = _open_journal(self._journal_path(obj.source), self.journal_buffering)
+            self._journals[obj.source] = journal
+        journal.write(_dumps(obj) + b"\n")
     
     def get_object(self, obj_id: str) -> Optional[ObjectRecord]:
-        """Get an object record by ID."""
-        obj_dict = self.data["objects"].get(obj_id)
-        if obj_dict is None:
-            return None
-        
-        # Convert dict back to dataclass
-        # Make a copy to avoid modifying the internal data
-        obj_data = obj_dict.copy()
-        views = [ViewInfo(**v) if isinstance(v, dict) else v for v in obj_data.get("views", [])]
-        obj_data["views"] = views
-        return ObjectRecord(**obj_data)
+        """Get an object record by ID.
+        
+        This is the stored instance; call add_object after modifying it so
+        the change is journaled. Shards are loaded until the ID is found.
+        """
+        for objects in self._shards.values():
+            obj = objects.get(obj_id)
+            if obj is not None:
+                return obj
+        for source in sorted(self._sources - self._shards.keys()):
+            obj = self._ensure_loaded(source).get(obj_id)
+            if obj is not None:
+                return obj
+        return None
+    
+    def object_ids(self, *sources: str) -> Set[str]:
+        """Get the IDs of all objects from the given sources (default: all)."""
+        if not sources:
+            self._load_all()
+            sources = tuple(self._shards)
+        ids = set()
+        for source in sources:
+            ids.update(self._ensure_loaded(source))
+        return ids
     
     def get_all_objects(self) -> List[ObjectRecord]:
         """Get all object records."""
-        objects = []
-        for obj_dict in self.data["objects"].values():
-            obj_data = obj_dict.copy()
-            views = [ViewInfo(**v) if isinstance(v, dict) else v for v in obj_data.get("views", [])]
-            obj_data["views"] = views
-            objects.append(ObjectRecord(**obj_data))
-        return objects
+        self._load_all()
+        return [obj for objects in self._shards.values() for obj in objects.values()]
     
     def get_objects_by_status(self, download_status: Optional[str] = None, 
                              render_status: Optional[str] = None) -> List[ObjectRecord]:
@@ -109,14 +425,23 @@ class Manifest:
     
     def get_stats(self) -> Dict[str, Any]:
         """Get manifest statistics."""
-        all_objs = self.get_all_objects()
-        
+        status_counts = sum(self._status_counts.values(), Counter())
+        render_counts = sum(self._render_counts.values(), Counter())
         return {
-            "total": len(all_objs),
-            "downloaded": len([o for o in all_objs if o.download_status == "success"]),
-            "download_failed": len([o for o in all_objs if o.download_status == "failed"]),
-            "download_pending": len([o for o in all_objs if o.download_status == "pending"]),
-            "rendered": len([o for o in all_objs if o.render_status == "success"]),
-            "render_failed": len([o for o in all_objs if o.render_status == "failed"]),
-            "render_pending": len([o for o in all_objs if o.render_status == "pending"]),
+            "total": sum(status_counts.values()),
+            "downloaded": status_counts["success"],
+            "download_failed": status_counts["failed"],
+            "download_pending": status_counts["pending"],
+            "rendered": render_counts["success"],
+            "render_failed": render_counts["failed"],
+            "render_pending": render_counts["pending"],
         }
+    
+    def stats_by_source(self) -> Dict[str, int]:
+        """Get the number of objects per source."""
+        by_source = {}
+        for source, counts in self._status_counts.items():
+            total = sum(counts.values())
+            if total > 0:
+                by_source[source] = total
+        return by_source
@@ -2,12 +2,59 @@ import bpy
 import os
 import sys
 import argparse
+import json
 import math
 import mathutils
+import numpy as np
 
-def reset_scene():
-    bpy.ops.object.select_all(action='SELECT')
-    bpy.ops.object.delete()
+# Blender's PNG compression (0-100) maps to zlib level ~compression/11, so 15
+# is level 1: the fastest setting that still deflates. Set explicitly so a
+# user's startup file can't slow every write down.
+PNG_COMPRESSION = 15
+
+# EEVEE samples per view. The default (64) is far more than flat synthetic
+# renders need; a few samples still give anti-aliased mask edges.
+EEVEE_SAMPLES = 4
+
+NUM_VIEWS = 6
+
+# Camera positions: NUM_VIEWS azimuths orbiting the origin at distance 2.2,
+# slightly elevated. Identical for every object, so computed once.
+CAM_DIST = 2.2
+CAM_HEIGHT = 1.0
+CAM_POSES = tuple(
+    (CAM_DIST * math.sin(i * 2 * math.pi / NUM_VIEWS),
+     -CAM_DIST * math.cos(i * 2 * math.pi / NUM_VIEWS),
+     CAM_HEIGHT)
+    for i in range(NUM_VIEWS)
+)
+
+# Prefix of the status line written to stdout per object in --serve mode.
+# Must match RESULT_PREFIX in run_rendering.py.
+RESULT_PREFIX = "RENDER_RESULT "
+
+# Lights, cameras and compositor are built once per Blender session and
+# reused for every object: (names of the rig's objects, mask File Output node)
+_rig = None
+
+def reset_scene(keep=frozenset()):
+    for obj in list(bpy.data.objects):
+        if obj.name not in keep:
+            bpy.data.objects.remove(obj, do_unlink=True)
+    
+    # Drop everything the previous object left behind in a persistent session
+    bpy.data.orphans_purge(do_recursive=True)
+
+def setup_rig(file_format='png'):
+    global _rig
+    if _rig is None:
+        reset_scene()
+        bpy.context.scene.timeline_markers.clear()
+        setup_lighting()
+        setup_cameras()
+        mask_out = configure_rendering(file_format)
+        _rig = (frozenset(obj.name for obj in bpy.data.objects), mask_out)
+    return _rig
 
 def setup_lighting():
     # Create a light
@@ -21,38 +68,127 @@ def setup_lighting():
     area.data.energy = 50
 
 def normalize_object(obj):
-    # Center object
-    bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY', center='BOUNDS')
-    obj.location = (0, 0, 0)
-    
-    # Scale object to fit in unit sphere
-    dim = obj.dimensions
-    max_dim = max(dim)
-    if max_dim > 0:
-        scale_factor = 1.0 / max_dim
-        obj.scale = (scale_factor, scale_factor, scale_factor)
-    
-    bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-
-def setup_camera():
-    bpy.ops.object.camera_add(location=(0, -2.5, 1))
-    cam = bpy.context.active_object
-    cam.data.lens = 35
-    
-    # Look at origin constraint
-    constraint = cam.constraints.new(type='TRACK_TO')
-    constraint.target = bpy.data.objects.new("Target", None) # Empty at origin
-    constraint.track_axis = 'TRACK_NEGATIVE_Z'
-    constraint.up_axis = 'UP_Y'
+    # Bake the object's transform into the vertices
+    mesh = obj.data
+    # shape_keys=True: a shape-keyed mesh renders from its key blocks, so
+    # they have to move with the vertices
+    mesh.transform(obj.matrix_world, shape_keys=True)
+    # Detach from any importer parent chain (e.g. glTF root nodes) so the
+    # object stands alone in the scene and in its .blend cache
+    obj.parent = None
+    obj.matrix_world = mathutils.Matrix.Identity(4)
+    if not mesh.vertices:
+        return
+    
+    # Bounds from one bulk copy of the vertex coordinates, instead of the
+    # origin_set/transform_apply operators
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3)
+    lo, hi = co.min(axis=0), co.max(axis=0)
+    
+    # Center object and scale it to fit in a unit cube
+    max_dim = float((hi - lo).max())
+    scale_factor = 1.0 / max_dim if max_dim > 0 else 1.0
+    center = mathutils.Vector(((lo + hi) / 2).tolist())
+    mesh.transform(mathutils.Matrix.Scale(scale_factor, 4) @ mathutils.Matrix.Translation(-center),
+                   shape_keys=True)
+    mesh.update()
+
+def setup_cameras():
+    # 6 views: Front, Back, Left, Right, Top, Bottom? 
+    # Or 6 rotations around Z? Let's do 6 rotations around Z for now + maybe some elevation variation.
+    # User asked for "different viewpoints". 
+    # Let's do 6 azimuth angles at a fixed elevation.
+    #
+    # One camera per view, each bound to frame i through a timeline marker, so
+    # a single animation render produces every view.
+    scene = bpy.context.scene
+    target = bpy.data.objects.new("Target", None) # Empty at origin
+    # Link it so it has a user; orphans_purge in reset_scene would delete it
+    scene.collection.objects.link(target)
+    cams = []
+    
+    for i in range(NUM_VIEWS):
+        bpy.ops.object.camera_add(location=CAM_POSES[i])
+        cam = bpy.context.active_object
+        cam.data.lens = 35
+        
+        # Look at origin constraint
+        constraint = cam.constraints.new(type='TRACK_TO')
+        constraint.target = target
+        constraint.track_axis = 'TRACK_NEGATIVE_Z'
+        constraint.up_axis = 'UP_Y'
+        
+        marker = scene.timeline_markers.new(f"view_{i}", frame=i)
+        marker.camera = cam
+        cams.append(cam)
     
     # Set as active camera for the scene
-    bpy.context.scene.camera = cam
+    scene.camera = cams[0]
+    scene.frame_start = 0
+    scene.frame_end = NUM_VIEWS - 1
     
-    return cam
+    return cams
 
-def configure_rendering(output_path):
-    bpy.context.scene.render.image_settings.file_format = 'PNG'
-    bpy.context.scene.render.filepath = output_path
+def setup_mask_output():
+    # Route the render's alpha into a File Output node so Blender writes the
+    # mask itself during the same render, instead of us reloading the PNG.
+    scene = bpy.context.scene
+    if hasattr(scene, "compositing_node_group"):
+        # Blender 5.0+: the compositor is a node group ending in a Group Output
+        tree = bpy.data.node_groups.new("Compositor", "CompositorNodeTree")
+        tree.interface.new_socket("Image", in_out='OUTPUT', socket_type='NodeSocketColor')
+        scene.compositing_node_group = tree
+        output = tree.nodes.new("NodeGroupOutput")
+    else:
+        scene.use_nodes = True
+        tree = scene.node_tree
+        tree.nodes.clear()
+        output = tree.nodes.new("CompositorNodeComposite")
+    scene.render.use_compositing = True
+    
+    layers = tree.nodes.new("CompositorNodeRLayers")
+    tree.links.new(layers.outputs["Image"], output.inputs[0])
+    
+    mask_out = tree.nodes.new("CompositorNodeOutputFile")
+    if not mask_out.inputs:
+        mask_out.file_output_items.new('FLOAT', "Alpha")
+    mask_out.format.file_format = 'PNG'
+    mask_out.format.color_mode = 'BW'  # One channel to encode instead of four
+    mask_out.format.color_depth = '8'  # Not 16: the mask is 8-bit grayscale
+    mask_out.format.compression = PNG_COMPRESSION
+    tree.links.new(layers.outputs["Alpha"], mask_out.inputs[0])
+    
+    return mask_out
+
+def set_mask_path(mask_out, output_dir, name):
+    if hasattr(mask_out, "directory"):
+        mask_out.directory = output_dir
+    else:
+        mask_out.base_path = output_dir
+    # A '#' in name is replaced by the frame number
+    if hasattr(mask_out, "file_name"):
+        mask_out.file_name = name
+    else:
+        mask_out.file_slots[0].path = name
+
+def configure_rendering(file_format='png'):
+    if file_format == 'exr':
+        # One half-float RGBA EXR per view; the mask is its alpha channel,
+        # so there is one file per view instead of two and no compositor
+        # pass. ZIP is still zlib deflate, over four 16-bit channels.
+        # Blender writes EXR scene-linear with premultiplied alpha and no
+        # view transform, so the pixels differ from the sRGB, straight-alpha
+        # PNGs; they are not interchangeable training images.
+        bpy.context.scene.render.image_settings.file_format = 'OPEN_EXR'
+        bpy.context.scene.render.image_settings.exr_codec = 'ZIP'
+        bpy.context.scene.render.image_settings.color_depth = '16'
+    else:
+        bpy.context.scene.render.image_settings.file_format = 'PNG'
+        bpy.context.scene.render.image_settings.compression = PNG_COMPRESSION
+        bpy.context.scene.render.image_settings.color_depth = '8'
+    bpy.context.scene.render.image_settings.color_mode = 'RGBA'
     bpy.context.scene.render.resolution_x = 512
     bpy.context.scene.render.resolution_y = 512
     
@@ -61,99 +197,105 @@ def configure_rendering(output_path):
     
     # Use Cycles for better quality or Eevee for speed. Eevee is fine for simple synthetic data.
     bpy.context.scene.render.engine = 'BLENDER_EEVEE'
-
-def render_views(obj, output_dir, object_id):
-    cam = setup_camera()
+    bpy.context.scene.eevee.taa_render_samples = EEVEE_SAMPLES
+    bpy.context.scene.eevee.use_raytracing = False
     
-    # 6 views: Front, Back, Left, Right, Top, Bottom? 
-    # Or 6 rotations around Z? Let's do 6 rotations around Z for now + maybe some elevation variation.
-    # User asked for "different viewpoints". 
-    # Let's do 6 azimuth angles at a fixed elevation.
+    # Keep scene data (geometry, shaders) between the 6 view renders
+    bpy.context.scene.render.use_persistent_data = True
     
-    for i in range(6):
-        angle = (i / 6.0) * 2 * math.pi
-        
-        # Orbit camera
-        dist = 2.2
-        x = dist * math.sin(angle)
-        y = -dist * math.cos(angle)
-        z = 1.0 # Slight elevation
-        
-        cam.location = (x, y, z)
-        
-        # Render RGB with alpha
-        image_path = os.path.join(output_dir, f"{object_id}_view_{i}.png")
-        bpy.context.scene.render.filepath = image_path
-        bpy.ops.render.render(write_still=True)
-        
-        # Create mask from alpha channel
-        # Save a separate mask file by reading the rendered PNG
-        mask_path = os.path.join(output_dir, f"{object_id}_view_{i}_mask.png")
-        
-        # Use Blender's image functions to extract alpha
-        try:
-            # Load the rendered image
-            img = bpy.data.images.load(image_path)
-            
-            # Create a new image for the mask
-            mask_img = bpy.data.images.new(name="mask", width=img.size[0], height=img.size[1], alpha=False, float_buffer=False)
-            
-            # Convert alpha channel to grayscale mask
-            pixels = list(img.pixels)
-            mask_pixels = []
-            for i_pix in range(0, len(pixels), 4):  # RGBA
-                alpha = pixels[i_pix + 3]  # Get alpha channel
-                mask_pixels.extend([alpha, alpha, alpha, 1.0])  # Convert to grayscale RGBA
-            
-            mask_img.pixels = mask_pixels
-            mask_img.filepath_raw = mask_path
-            mask_img.file_format = 'PNG'
-            mask_img.save()
-            
-            # Clean up
-            bpy.data.images.remove(img)
-            bpy.data.images.remove(mask_img)
-        except Exception as e:
-            print(f"Warning: Could not create mask for view {i}: {e}")
+    if file_format == 'exr':
+        bpy.context.scene.render.use_compositing = False
+        return None
+    return setup_mask_output()
 
-def main():
-    # Parse args
-    # Blender args are passed after "--"
-    argv = sys.argv
-    if "--" in argv:
-        argv = argv[argv.index("--") + 1:]
+def render_views(obj, output_dir, object_id, mask_out):
+    # Importers may change the frame range; keep it at one frame per view.
+    # Imported animation is dropped in import_object.
+    scene = bpy.context.scene
+    scene.frame_start = 0
+    scene.frame_end = NUM_VIEWS - 1
     
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input", required=True, help="Path to input 3D file")
-    parser.add_argument("--output_dir", required=True, help="Directory to save renders")
-    args = parser.parse_args(argv)
-    
-    reset_scene()
-    setup_lighting()
+    # Render all views in one animation pass: frame i -> view i. Blender
+    # expands '#' to the frame number; the compositor writes the masks.
+    bpy.context.scene.render.filepath = os.path.join(output_dir, f"{object_id}_view_#")
+    if mask_out is not None:
+        set_mask_path(mask_out, output_dir, f"{object_id}_view_#_mask")
+    bpy.ops.render.render(animation=True)
+
+# Name of the normalized object inside a .normalized.blend cache
+CACHED_OBJECT_NAME = "normalized"
+
+def cache_path_for(input_path):
+    # Normalized mesh saved next to the source on first render
+    return os.path.splitext(input_path)[0] + ".normalized.blend"
+
+def load_cached_object(cache_path, input_path):
+    """Append the normalized object from its .blend cache, or return None."""
+    try:
+        if os.path.getmtime(cache_path) < os.path.getmtime(input_path):
+            return None  # Source changed since the cache was written
+        with bpy.data.libraries.load(cache_path) as (data_from, data_to):
+            # Only the mesh object; the file may also hold other objects it
+            # referenced when it was written
+            if CACHED_OBJECT_NAME not in data_from.objects:
+                return None
+            data_to.objects = [CACHED_OBJECT_NAME]
+    except (OSError, RuntimeError):
+        return None
     
-    # Import object
-    ext = os.path.splitext(args.input)[1].lower()
+    obj = data_to.objects[0]
+    if obj is None or obj.type != 'MESH':
+        return None
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+def save_cached_object(cache_path, obj):
+    # A fixed name lets load_cached_object pick the mesh out of the file
+    other = bpy.data.objects.get(CACHED_OBJECT_NAME)
+    if other is not None and other != obj:
+        other.name = CACHED_OBJECT_NAME + "_imported"
+    obj.name = CACHED_OBJECT_NAME
+    # Write to a temporary file first so a crash can't leave a truncated cache
+    tmp_path = cache_path[:-len(".blend")] + ".tmp.blend"
+    try:
+        bpy.data.libraries.write(tmp_path, {obj}, path_remap='ABSOLUTE')
+        os.replace(tmp_path, cache_path)
+    except (OSError, RuntimeError) as e:
+        print(f"Could not cache {cache_path}: {e}")
+
+def import_object(input_path):
+    """Import, join and normalize the meshes in input_path into one object."""
+    ext = os.path.splitext(input_path)[1].lower()
+    if ext not in ['.glb', '.gltf', '.obj', '.fbx']:
+        raise RuntimeError(f"Unsupported file format: {ext}")
     try:
         if ext in ['.glb', '.gltf']:
-            bpy.ops.import_scene.gltf(filepath=args.input)
+            bpy.ops.import_scene.gltf(filepath=input_path)
         elif ext == '.obj':
-            bpy.ops.import_scene.obj(filepath=args.input)
+            bpy.ops.import_scene.obj(filepath=input_path)
         elif ext == '.fbx':
-            bpy.ops.import_scene.fbx(filepath=args.input)
-        else:
-            print(f"Unsupported file format: {ext}")
-            return
+            bpy.ops.import_scene.fbx(filepath=input_path)
     except Exception as e:
-        print(f"Failed to import {args.input}: {e}")
-        return
+        raise RuntimeError(f"Failed to import {input_path}: {e}")
+    
+    # The views are frames 0-5 of one animation render, so any imported
+    # animation would pose the object differently in each view. Drop it and
+    # keep the pose it has now; the frames then differ only by camera.
+    for o in bpy.context.scene.objects:
+        o.animation_data_clear()
+        data = o.data
+        if data is not None and hasattr(data, "animation_data_clear"):
+            data.animation_data_clear()
+        shape_keys = getattr(data, "shape_keys", None)
+        if shape_keys is not None:
+            shape_keys.animation_data_clear()
 
     # Select the imported object(s)
     bpy.ops.object.select_all(action='DESELECT')
     mesh_objs = [o for o in bpy.context.scene.objects if o.type == 'MESH']
     
     if not mesh_objs:
-        print("No mesh found in file.")
-        return
+        raise RuntimeError("No mesh found in file.")
         
     # Select all meshes
     for obj in mesh_objs:
@@ -169,11 +311,66 @@ def main():
     # Now we have one object
     obj = bpy.context.active_object
     normalize_object(obj)
+    return obj
+
+def render_object(input_path, output_dir, file_format='png'):
+    rig_objects, mask_out = setup_rig(file_format)
+    reset_scene(keep=rig_objects)
     
-    object_id = os.path.splitext(os.path.basename(args.input))[0]
-    configure_rendering(args.output_dir)
+    # Reuse the normalized mesh from an earlier run (e.g. --retry_failed)
+    # instead of importing and normalizing the source again
+    cache_path = cache_path_for(input_path)
+    obj = load_cached_object(cache_path, input_path)
+    if obj is None:
+        obj = import_object(input_path)
+        save_cached_object(cache_path, obj)
     
-    render_views(bpy.context.active_object, args.output_dir, object_id)
+    object_id = os.path.splitext(os.path.basename(input_path))[0]
+    render_views(obj, output_dir, object_id, mask_out)
+
+def serve(file_format='png'):
+    # Persistent worker: one JSON job per stdin line, one status line back.
+    # Blender starts once and renders objects until stdin is closed.
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        job = json.loads(line)
+        try:
+            render_object(job["input"], job["output_dir"], file_format)
+            result = {"ok": True}
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+def main():
+    # Parse args
+    # Blender args are passed after "--"
+    argv = sys.argv
+    if "--" in argv:
+        argv = argv[argv.index("--") + 1:]
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", help="Path to input 3D file")
+    parser.add_argument("--output_dir", help="Directory to save renders")
+    parser.add_argument("--serve", action="store_true",
+                        help='Render {"input": ..., "output_dir": ...} JSON lines read from stdin')
+    parser.add_argument("--format", choices=["png", "exr"], default="png",
+                        help="png: sRGB RGBA view + separate mask PNG; exr: one scene-linear, "
+                             "premultiplied RGBA EXR per view, mask in alpha (different pixels, not a drop-in)")
+    args = parser.parse_args(argv)
+    
+    if args.serve:
+        serve(args.format)
+        return
+    
+    if not args.input or not args.output_dir:
+        parser.error("--input and --output_dir are required unless --serve is given")
+    
+    try:
+        render_object(args.input, args.output_dir, args.format)
+    except RuntimeError as e:
+        print(e)
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,11 @@
 import os
+import sys
 import argparse
+import json
+import queue
 import subprocess
+import threading
+from collections import deque
 from tqdm import tqdm
 import multiprocessing
 import time
@@ -9,74 +14,231 @@ from manifest import Manifest, ViewInfo
 
 SUPPORTED_EXTS = ['.glb', '.gltf', '.obj', '.fbx']
 
+# Prefix of the per-object status line printed by render_objects.py --serve.
+# Must match RESULT_PREFIX in render_objects.py.
+RESULT_PREFIX = "RENDER_RESULT "
+
+# Pixel encoding Blender writes for each --format, recorded on every view so
+# loaders don't mix the two: PNG is view-transformed sRGB with straight
+# alpha, EXR is scene-linear with premultiplied alpha.
+VIEW_COLORSPACE = {"png": "srgb", "exr": "linear_premultiplied"}
+
+
+class BlenderWorker:
+    """A long-lived Blender process that renders one object per request.
+    
+    Blender's startup cost is paid once per worker instead of once per
+    object. Jobs are sent as JSON lines on stdin; render_objects.py answers
+    each with a RESULT_PREFIX line on stdout.
+    """
+    
+    def __init__(self, blender_path, script_path, gpu=None, log_path=None, file_format="png"):
+        self.cmd = [
+            blender_path,
+            "--background",
+            # Skip user prefs, add-ons and startup.blend; never run embedded scripts
+            "--factory-startup",
+            "--disable-autoexec",
+            # Exit non-zero if the render script raises
+            "--python-exit-code", "1",
+            "--python", script_path,
+            "--",
+            "--serve",
+            "--format", file_format
+        ]
+        # Restrict this Blender's CUDA/HIP compute to one GPU. EEVEE draws
+        # through OpenGL/EGL or Vulkan, which ignore these variables, so
+        # EEVEE renders still use the default display GPU.
+        env = None
+        if gpu is not None:
+            env = {**os.environ, "CUDA_VISIBLE_DEVICES": str(gpu), "HIP_VISIBLE_DEVICES": str(gpu)}
+        # Blender's stderr goes to a log file that is only read on failure.
+        # Append mode lets us truncate it between jobs while Blender writes.
+        self.log = open(log_path or os.devnull, "a+b")
+        self.proc = subprocess.Popen(
+            self.cmd,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.log,
+            text=True,
+            bufsize=1
+        )
+        self.results = queue.Queue()
+        self.tail = deque(maxlen=20)  # Last stdout lines, for error messages
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+    
+    def _read_output(self):
+        # Drain stdout continuously so Blender never blocks on a full pipe
+        for line in self.proc.stdout:
+            if line.startswith(RESULT_PREFIX):
+                self.results.put(json.loads(line[len(RESULT_PREFIX):]))
+            else:
+                self.tail.append(line)
+        self.results.put(None)  # EOF: Blender exited
+    
+    def alive(self):
+        return self.proc.poll() is None
+    
+    def log_tail(self, size=4096):
+        """Last bytes Blender wrote to stderr during the current job."""
+        self.log.seek(0, os.SEEK_END)
+        self.log.seek(max(0, self.log.tell() - size))
+        return self.log.read().decode(errors="replace")
+    
+    def render(self, input_path, output_dir, timeout):
+        """Render one object. Returns None on success or an error message.
+        
+        Raises subprocess.TimeoutExpired (after killing Blender) on timeout.
+        """
+        job = {"input": input_path, "output_dir": output_dir}
+        self.tail.clear()
+        self.log.truncate(0)
+        self.proc.stdin.write(json.dumps(job) + "\n")
+        self.proc.stdin.flush()
+        
+        try:
+            result = self.results.get(timeout=timeout)
+        except queue.Empty:
+            self.close(kill=True)
+            raise subprocess.TimeoutExpired(self.cmd, timeout)
+        
+        if result is None:
+            self.proc.wait()
+            output = self.log_tail() or ''.join(self.tail)
+            return f"Blender exited with code {self.proc.returncode}: {output[-200:]}"
+        return None if result["ok"] else result["error"]
+    
+    def close(self, kill=False):
+        if kill:
+            self.proc.kill()
+        elif self.proc.stdin:
+            self.proc.stdin.close()
+        self.proc.wait()
+        self.log.close()
+
+
+# One persistent Blender per worker process, started on first use
+_worker = None
+# GPU assigned to this worker process by worker_loop (None: no pinning)
+_gpu_index = None
+
+
+def worker_loop(gpu, in_q, out_q, config):
+    """Worker process: render (obj_id, local_path) jobs from in_q until None.
+    
+    config holds the per-run constants that complete a render_object task.
+    Each result tuple goes to out_q; None is put last when the worker exits.
+    """
+    global _gpu_index
+    _gpu_index = gpu
+    try:
+        for job in iter(in_q.get, None):
+            out_q.put(render_object(job + config))
+    finally:
+        if _worker is not None:
+            _worker.close()
+        out_q.put(None)
+
+
+def get_worker(blender_path, script_path, log_path=None, file_format="png"):
+    global _worker
+    if _worker is None or not _worker.alive():
+        if _worker is not None:
+            _worker.close()
+        _worker = BlenderWorker(blender_path, script_path, gpu=_gpu_index,
+                                log_path=log_path, file_format=file_format)
+    return _worker
+
+
+def detect_gpus():
+    """Count NVIDIA GPUs with nvidia-smi. Returns 0 if it isn't available."""
+    try:
+        out = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 0
+    return sum(1 for line in out.splitlines() if line.startswith("GPU "))
+
+
+def gpu_devices(num_gpus=None):
+    """Device IDs to pin workers to, round-robin. Empty: no pinning.
+    
+    An existing CUDA_VISIBLE_DEVICES restriction is respected: workers are
+    spread over its entries (nvidia-smi ignores it and lists every GPU).
+    """
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        devices = [d.strip() for d in visible.split(",") if d.strip()]
+        return devices if num_gpus is None else devices[:num_gpus]
+    if num_gpus is None:
+        num_gpus = detect_gpus()
+    return [str(i) for i in range(num_gpus)]
+
 
 def render_object(args_tuple):
     """Render a single object with Blender."""
-    obj_record, output_dir, blender_path, script_path, timeout, base_dir = args_tuple
+    obj_id, local_path, output_dir, blender_path, script_path, timeout, base_dir, file_format = args_tuple
     
-    obj_id = obj_record.id
     # Resolve absolute path relative to manifest location
-    obj_path = os.path.join(base_dir, obj_record.local_path)
+    obj_path = os.path.join(base_dir, local_path)
     
-    # Create output folder for this object
+    # Output folder is created up front by main()
     obj_output_dir = os.path.join(output_dir, obj_id)
-    os.makedirs(obj_output_dir, exist_ok=True)
-    
-    cmd = [
-        blender_path,
-        "--background",
-        "--python", script_path,
-        "--",
-        "--input", obj_path,
-        "--output_dir", obj_output_dir
-    ]
     
     start_time =time.time()
     
     try:
-        subprocess.run(
-            cmd,
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            timeout=timeout
-        )
+        log_path = os.path.join(output_dir, f"blender_{os.getpid()}.log")
+        error = get_worker(blender_path, script_path, log_path, file_format).render(obj_path, obj_output_dir, timeout)
         
         render_time = time.time() - start_time
         
-        # Check if views were created
+        if error is not None:
+            return (obj_id, "failed", error[:200], render_time, [])
+        
+        # Check if views were created; one directory read instead of a stat per file
+        with os.scandir(obj_output_dir) as entries:
+            existing = {entry.name for entry in entries}
         views = []
         for i in range(6):
-            image_path = os.path.join(obj_output_dir, f"{obj_id}_view_{i}.png")
-            mask_path = os.path.join(obj_output_dir, f"{obj_id}_view_{i}_mask0001.png")
+            image_name = f"{obj_id}_view_{i}.{file_format}"
+            # EXR views carry the mask in their alpha channel
+            mask_name = image_name if file_format == "exr" else f"{obj_id}_view_{i}_mask.png"
             
-            if os.path.exists(image_path):
+            if image_name in existing:
                 views.append(ViewInfo(
                     view_id=i,
-                    image_path=os.path.relpath(image_path, output_dir),
-                    mask_path=os.path.relpath(mask_path, output_dir) if os.path.exists(mask_path) else ""
+                    image_path=os.path.join(obj_id, image_name),
+                    mask_path=os.path.join(obj_id, mask_name) if mask_name in existing else "",
+                    colorspace=VIEW_COLORSPACE[file_format]
                 ))
         
         if len(views) == 6:
             return (obj_id, "success", None, render_time, views)
         else:
-            return (obj_id, "failed", f"Only {len(views)}/6 views created", render_time, views)
+            missing = sorted(set(range(6)) - {v.view_id for v in views})
+            return (obj_id, "failed", f"Only {len(views)}/6 views created (missing {missing})", render_time, views)
             
     except subprocess.TimeoutExpired:
         return (obj_id, "failed", f"Timeout after {timeout}s", time.time() - start_time, [])
-    except subprocess.CalledProcessError as e:
-        error_msg = e.stderr.decode() if e.stderr else "Unknown error"
-        return (obj_id, "failed", error_msg[:200], time.time() - start_time, [])
     except Exception as e:
         return (obj_id, "failed", str(e)[:200], time.time() - start_time, [])
 
 
 def main():
     parser = argparse.ArgumentParser(description="Batch render 3D objects.")
-    parser.add_argument("--manifest", default="./data/objaverse/manifest.json", help="Path to download manifest.json")
+    parser.add_argument("--manifest", default="./data/objaverse/manifest.json", help="Path to download manifest.json (shards live in manifest/ next to it)")
     parser.add_argument("--output_dir", default="./renders", help="Directory to save renders.")
     parser.add_argument("--blender_path", default="blender", help="Path to blender executable.")
     parser.add_argument("--num_workers", type=int, default=4, help="Number of parallel renders.")
+    parser.add_argument("--num_gpus", type=int, default=None,
+                        help="GPUs to spread workers' CUDA/HIP compute across via CUDA_VISIBLE_DEVICES/HIP_VISIBLE_DEVICES "
+                             "(default: all in CUDA_VISIBLE_DEVICES, else detect with nvidia-smi; 0 disables). "
+                             "Does not move EEVEE rendering, which uses the OpenGL/Vulkan device.")
+    parser.add_argument("--format", choices=["png", "exr"], default="png",
+                        help="png: sRGB view + mask PNGs; exr: one scene-linear, premultiplied RGBA EXR per view with "
+                             "the mask in alpha. EXR pixels differ from PNG (no view transform), so don't mix the two.")
     parser.add_argument("--timeout", type=int, default=60, help="Timeout per object in seconds.")
     parser.add_argument("--resume", action="store_true", help="Skip already rendered objects.")
     parser.add_argument("--retry_failed", action="store_true", help="Retry previously failed renders.")
@@ -92,7 +254,8 @@ def main():
     
     # Load manifest
     print(f"Loading manifest from {args.manifest}...")
-    manifest = Manifest(args.manifest)
+    # Render results are journaled; buffer them and flush every few objects
+    manifest = Manifest(args.manifest, journal_buffering=1 << 20)
     
     # Get successfully downloaded objects
     downloaded_objects = manifest.get_objects_by_status(download_status="success")
@@ -140,22 +303,58 @@ def main():
             print(f"  ... and {len(to_render) - 10} more")
         return
     
+    # Create every object's output folder here so workers don't have to
     os.makedirs(args.output_dir, exist_ok=True)
+    for obj in to_render:
+        os.makedirs(os.path.join(args.output_dir, obj.id), exist_ok=True)
     
     # Determine base directory for objects (relative to manifest)
     base_dir = os.path.dirname(args.manifest)
     
-    # Prepare rendering tasks
-    tasks = [
-        (obj, args.output_dir, args.blender_path, script_path, args.timeout, base_dir)
-        for obj in to_render
+    # Only the ID and path go through the queue per object; the rest of a
+    # render_object task is the same for the whole run
+    config = (args.output_dir, args.blender_path, script_path, args.timeout, base_dir, args.format)
+    
+    devices = gpu_devices(args.num_gpus)
+    if devices:
+        print(f"Setting workers' CUDA/HIP devices round-robin across {len(devices)} GPUs: {','.join(devices)}"
+              " (EEVEE rendering is not affected)")
+    
+    # Fork where available so workers inherit the parent's imports instead of
+    # re-importing this module; Windows only has spawn
+    ctx = multiprocessing.get_context("spawn" if sys.platform == "win32" else "fork")
+    in_q = ctx.Queue()
+    out_q = ctx.Queue()
+    
+    # Each worker process owns one persistent Blender, given a CUDA/HIP device by its index
+    workers = [
+        ctx.Process(target=worker_loop, args=(devices[i % len(devices)] if devices else None, in_q, out_q, config), daemon=True)
+        for i in range(args.num_workers)
     ]
+    for w in workers:
+        w.start()
+    for obj in to_render:
+        in_q.put((obj.id, obj.local_path))
+    for _ in workers:
+        in_q.put(None)
     
-    # Render with progress bar
+    # Drain results into the manifest as they arrive
     results = []
-    with multiprocessing.Pool(args.num_workers) as pool:
-        for result in tqdm(pool.imap_unordered(render_object, tasks), total=len(tasks), desc="Rendering"):
+    running = len(workers)
+    with tqdm(total=len(to_render), desc="Rendering") as pbar:
+        while running:
+            try:
+                result = out_q.get(timeout=5)
+            except queue.Empty:
+                # A worker killed outright never sends its final None
+                if not any(w.is_alive() for w in workers):
+                    break
+                continue
+            if result is None:
+                running -= 1
+                continue
             results.append(result)
+            pbar.update()
             
             # Update manifest with result
             obj_id, status, error, render_time, views = result
@@ -167,12 +366,15 @@ def main():
                 obj.views = views
                 manifest.add_object(obj)
             
-            # Save periodically
+            # Flush the journal periodically so a crash loses at most a few results
             if len(results) % 10 == 0:
-                manifest.save()
+                manifest.flush()
+    
+    for w in workers:
+        w.join()
     
-    # Final save
-    manifest.save()
+    # Fold the journal into the manifest
+    manifest.compact()
     
     # Print statistics
     print("\n" + "="*60)